@@ -1,8 +1,13 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse, Response
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
 import logging
+import orjson
 import time
+import weakref
 
 from app.models.schemas import (
     OCRResponse, OCRBatchResponse, HealthResponse, ErrorResponse
@@ -10,11 +15,10 @@ from app.models.schemas import (
 from app.models.ollama_client import OllamaOCR
 from app.utils.image_processing import (
     validate_and_process_image, 
-    validate_batch_images,
-    get_image_info
+    validate_batch_images
 )
 from app.utils.latex_validator import post_process_latex
-from app.core.security import verify_api_key
+from app.core.security import verify_api_key, require_rate_limit
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
@@ -32,33 +36,163 @@ ollama_client = OllamaOCR(
 # Variável para tracking de uptime
 _start_time = time.time()
 
+# Configurações usadas a cada requisição, resolvidas uma vez na importação
+_MAX_IMAGE_SIZE_MB = settings.MAX_IMAGE_SIZE_MB
+_MAX_IMAGE_EDGE_PX = settings.MAX_IMAGE_EDGE_PX
+_ALLOWED_EXTENSIONS = settings.allowed_extensions_set
+_MAX_BATCH_SIZE = settings.MAX_BATCH_SIZE
 
-@router.get("/health", response_model=HealthResponse, tags=["Health"])
-async def health_check():
+# Limita quantas imagens de um batch são enviadas ao Ollama ao mesmo tempo
+# (um semáforo por event loop: asyncio.Semaphore fica preso ao primeiro loop
+# que o aguarda, e o TestClient cria um loop novo a cada requisição)
+_BATCH_CONCURRENCY = settings.BATCH_CONCURRENCY or 5
+_BATCH_SEMS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+# Cache LRU de predições: (sha256(imagem), use_fallback) -> (latex_raw, model_used)
+# (use_fallback faz parte da chave: um resultado obtido por um modelo de
+# fallback não pode ser servido a uma requisição que o desativou)
+_PRED_CACHE: "OrderedDict[Tuple[bytes, bool], Tuple[str, str]]" = OrderedDict()
+_PRED_CACHE_MAX = settings.PREDICTION_CACHE_SIZE
+
+# Predições em andamento: (sha256(imagem), use_fallback) -> Task da inferência
+# (requisições simultâneas da mesma imagem e mesmo use_fallback aguardam
+# uma única inferência)
+_INFLIGHT: Dict[Tuple[bytes, bool], asyncio.Task] = {}
+
+# Último estado conhecido do Ollama, atualizado em background por
+# poll_ollama_health (o /health apenas lê este snapshot)
+_HEALTH_POLL_INTERVAL = 2.0
+# Snapshot mais antigo que isso indica que a verificação travou (ex.: o
+# check_connection aguardando até o OLLAMA_TIMEOUT): reportar "degraded"
+_HEALTH_MAX_AGE = 3 * _HEALTH_POLL_INTERVAL
+_health_state = {"status": "degraded", "ollama_connected": False, "ts": 0.0}
+
+
+async def poll_ollama_health():
     """
-    Health check endpoint
+    Verifica periodicamente a conexão com o Ollama
     
-    Verifica se API e Ollama estão funcionando
+    Executada como tarefa em background a partir do startup, para que
+    o /health não abra conexões nem bloqueie o event loop a cada chamada.
     """
-    try:
-        ollama_connected = ollama_client.check_connection()
+    while True:
+        try:
+            connected = await asyncio.to_thread(ollama_client.check_connection)
+            status = "healthy" if connected else "degraded"
+        except Exception as e:
+            logger.error("Health check failed: %s", e)
+            connected = False
+            status = "unhealthy"
         
-        return HealthResponse(
-            status="healthy" if ollama_connected else "degraded",
-            ollama_connected=ollama_connected,
-            ollama_model=settings.OLLAMA_MODEL,
-            version=settings.VERSION,
-            uptime_seconds=time.time() - _start_time
+        _health_state.update(
+            status=status,
+            ollama_connected=connected,
+            ts=time.monotonic()
         )
-    except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
-        return HealthResponse(
-            status="unhealthy",
-            ollama_connected=False,
-            ollama_model=settings.OLLAMA_MODEL,
-            version=settings.VERSION,
-            uptime_seconds=time.time() - _start_time
+        await asyncio.sleep(_HEALTH_POLL_INTERVAL)
+
+
+def _get_batch_semaphore() -> asyncio.Semaphore:
+    """Retorna o semáforo de concorrência do batch para o event loop atual"""
+    loop = asyncio.get_running_loop()
+    sem = _BATCH_SEMS.get(loop)
+    if sem is None:
+        sem = _BATCH_SEMS[loop] = asyncio.Semaphore(_BATCH_CONCURRENCY)
+    return sem
+
+
+async def _predict(image, image_bytes: bytes, use_fallback: bool) -> Tuple[str, float, str]:
+    """
+    Executa OCR no Ollama com cache pelo conteúdo da imagem
+    
+    Imagens idênticas (mesmo SHA-256) reutilizam o resultado anterior
+    sem nova inferência; nesse caso o tempo de processamento é 0.
+    Se a mesma imagem já estiver sendo processada, aguarda o resultado
+    dessa inferência em vez de iniciar outra.
+    
+    Returns:
+        Tuple[str, float, str]: (latex_raw, processing_time_ms, model_used)
+    """
+    key = (hashlib.sha256(image_bytes).digest(), use_fallback)
+    
+    hit = _PRED_CACHE.get(key)
+    if hit is not None:
+        _PRED_CACHE.move_to_end(key)
+        latex_raw, model_used = hit
+        return latex_raw, 0.0, model_used
+    
+    task = _INFLIGHT.get(key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.create_task(
+            _run_prediction(key, image, image_bytes, use_fallback)
         )
+        # Evita aviso de exceção não lida quando ninguém mais aguarda a task
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        _INFLIGHT[key] = task
+    
+    # shield: o cancelamento de uma requisição (ex.: cliente desconectou)
+    # não cancela a inferência compartilhada nem as demais requisições
+    return await asyncio.shield(task)
+
+
+async def _run_prediction(
+    key: Tuple[bytes, bool],
+    image,
+    image_bytes: bytes,
+    use_fallback: bool
+) -> Tuple[str, float, str]:
+    """
+    Inferência compartilhada de _predict: grava o resultado no cache
+    mesmo que todas as requisições que aguardavam tenham sido canceladas
+    """
+    try:
+        # Chamada bloqueante fora do event loop
+        latex_raw, processing_time, model_used = await asyncio.to_thread(
+            ollama_client.predict,
+            image,
+            image_bytes,
+            use_fallback=use_fallback
+        )
+    finally:
+        if _INFLIGHT.get(key) is asyncio.current_task():
+            del _INFLIGHT[key]
+    
+    if _PRED_CACHE_MAX > 0:
+        _PRED_CACHE[key] = (latex_raw, model_used)
+        _PRED_CACHE.move_to_end(key)
+        if len(_PRED_CACHE) > _PRED_CACHE_MAX:
+            _PRED_CACHE.popitem(last=False)
+    
+    return latex_raw, processing_time, model_used
+
+
+@router.get("/health", response_model=HealthResponse, tags=["Health"])
+async def health_check():
+    """
+    Health check endpoint
+    
+    Verifica se API e Ollama estão funcionando (estado atualizado
+    em background a cada poucos segundos)
+    """
+    status = _health_state["status"]
+    ollama_connected = _health_state["ollama_connected"]
+    
+    if time.monotonic() - _health_state["ts"] > _HEALTH_MAX_AGE:
+        status = "degraded"
+        ollama_connected = False
+    
+    response = HealthResponse(
+        status=status,
+        ollama_connected=ollama_connected,
+        ollama_model=settings.OLLAMA_MODEL,
+        version=settings.VERSION,
+        uptime_seconds=time.time() - _start_time
+    )
+    
+    # uptime muda a cada chamada: serializar direto, sem revalidar o modelo
+    return ORJSONResponse(content=response.model_dump())
 
 
 @router.get("/models", tags=["Health"])
@@ -69,8 +203,8 @@ async def list_models(user: dict = Depends(verify_api_key)):
     Requer autenticação
     """
     try:
-        models_status = ollama_client.check_all_models()
-        return JSONResponse(content=models_status)
+        models_status = await asyncio.to_thread(ollama_client.check_all_models)
+        return ORJSONResponse(content=models_status)
     except Exception as e:
         logger.error(f"Error listing models: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -82,7 +216,7 @@ async def ocr_latex(
     return_metadata: bool = Query(False, description="Include processing metadata"),
     validate_latex: bool = Query(True, description="Validate and clean LaTeX output"),
     use_fallback: bool = Query(True, description="Use fallback models if primary fails"),
-    user: dict = Depends(verify_api_key)
+    user: dict = Depends(require_rate_limit)
 ):
     """
     Extract LaTeX code from image
@@ -100,14 +234,15 @@ async def ocr_latex(
     """
     try:
         # Validar e processar imagem
-        image, image_bytes = await validate_and_process_image(
+        image, image_bytes, image_info = await validate_and_process_image(
             file, 
-            settings.MAX_IMAGE_SIZE_MB,
-            settings.allowed_extensions_set
+            _MAX_IMAGE_SIZE_MB,
+            _ALLOWED_EXTENSIONS,
+            _MAX_IMAGE_EDGE_PX
         )
         
         # Extrair LaTeX usando Ollama
-        latex_raw, processing_time, model_used = ollama_client.predict(
+        latex_raw, processing_time, model_used = await _predict(
             image, 
             image_bytes,
             use_fallback=use_fallback
@@ -127,7 +262,6 @@ async def ocr_latex(
         # Construir metadata se solicitado
         metadata = None
         if return_metadata:
-            image_info = get_image_info(image)
             metadata = {
                 "filename": file.filename,
                 "user": user.get("name"),
@@ -138,11 +272,11 @@ async def ocr_latex(
             }
         
         logger.info(
-            f"OCR successful - User: {user.get('name')}, "
-            f"Model: {model_used}, Time: {processing_time:.2f}ms"
+            "OCR successful - User: %s, Model: %s, Time: %.2fms",
+            user.get('name'), model_used, processing_time
         )
         
-        return OCRResponse(
+        response = OCRResponse(
             success=True,
             latex=latex_code,
             latex_rendered=latex_rendered,
@@ -150,6 +284,10 @@ async def ocr_latex(
             metadata=metadata
         )
         
+        # Modelo já construído no servidor: serializar direto, sem revalidar
+        # pelo response_model (que fica apenas para a documentação OpenAPI)
+        return ORJSONResponse(content=response.model_dump())
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -166,7 +304,7 @@ async def ocr_latex_batch(
     return_metadata: bool = Query(False, description="Include processing metadata"),
     validate_latex: bool = Query(True, description="Validate and clean LaTeX output"),
     use_fallback: bool = Query(True, description="Use fallback models if primary fails"),
-    user: dict = Depends(verify_api_key)
+    user: dict = Depends(require_rate_limit)
 ):
     """
     Batch process multiple images
@@ -184,68 +322,80 @@ async def ocr_latex_batch(
     # Validar batch
     validated_images = await validate_batch_images(
         files,
-        settings.MAX_IMAGE_SIZE_MB,
-        settings.allowed_extensions_set,
-        max_batch_size=10
+        _MAX_IMAGE_SIZE_MB,
+        _ALLOWED_EXTENSIONS,
+        max_batch_size=_MAX_BATCH_SIZE,
+        max_dimension=_MAX_IMAGE_EDGE_PX
     )
     
-    results = []
-    successful = 0
-    total_time = 0
+    batch_sem = _get_batch_semaphore()
     
-    for image, image_bytes, filename in validated_images:
-        try:
-            # Processar cada imagem
-            latex_raw, processing_time, model_used = ollama_client.predict(
+    async def _one(image, image_bytes, filename):
+        """Processa uma imagem do batch respeitando o limite de concorrência"""
+        async with batch_sem:
+            latex_raw, processing_time, model_used = await _predict(
                 image,
                 image_bytes,
                 use_fallback=use_fallback
             )
-            
-            # Validar LaTeX
-            if validate_latex:
-                latex_processed = post_process_latex(latex_raw)
-                latex_code = latex_processed['cleaned']
-                latex_rendered = latex_processed['rendered']
-            else:
-                latex_code = latex_raw
-                latex_rendered = latex_raw
-            
-            # Metadata
-            metadata = None
-            if return_metadata:
-                metadata = {
-                    "filename": filename,
-                    "model_used": model_used
-                }
-            
-            results.append(OCRResponse(
-                success=True,
-                latex=latex_code,
-                latex_rendered=latex_rendered,
-                processing_time_ms=processing_time,
-                metadata=metadata
-            ))
-            
-            successful += 1
-            total_time += processing_time
-            
-        except Exception as e:
-            logger.error(f"Batch item failed ({filename}): {str(e)}")
+        
+        # Validar LaTeX
+        if validate_latex:
+            latex_processed = post_process_latex(latex_raw)
+            latex_code = latex_processed['cleaned']
+            latex_rendered = latex_processed['rendered']
+        else:
+            latex_code = latex_raw
+            latex_rendered = latex_raw
+        
+        # Metadata
+        metadata = None
+        if return_metadata:
+            metadata = {
+                "filename": filename,
+                "model_used": model_used
+            }
+        
+        return OCRResponse(
+            success=True,
+            latex=latex_code,
+            latex_rendered=latex_rendered,
+            processing_time_ms=processing_time,
+            metadata=metadata
+        )
+    
+    # Processar imagens em paralelo (limitado por _BATCH_CONCURRENCY)
+    outcomes = await asyncio.gather(
+        *[_one(*item) for item in validated_images],
+        return_exceptions=True
+    )
+    
+    results = []
+    successful = 0
+    total_time = 0
+    
+    for (_, _, filename), outcome in zip(validated_images, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Batch item failed ({filename}): {str(outcome)}")
             
             # Adicionar resultado de erro
             results.append(OCRResponse(
                 success=False,
                 latex="",
-                metadata={"filename": filename, "error": str(e)}
+                metadata={"filename": filename, "error": str(outcome)}
             ))
+            continue
+        
+        results.append(outcome)
+        successful += 1
+        total_time += outcome.processing_time_ms
     
     logger.info(
-        f"Batch OCR completed - User: {user.get('name')}, "
-        f"Total: {len(files)}, Success: {successful}, Failed: {len(files) - successful}"
+        "Batch OCR completed - User: %s, Total: %d, Success: %d, Failed: %d",
+        user.get('name'), len(files), successful, len(files) - successful
     )
     
-    return OCRBatchResponse(
+    response = OCRBatchResponse(
         success=True,
         results=results,
         total_images=len(files),
@@ -253,6 +403,17 @@ async def ocr_latex_batch(
         failed=len(files) - successful,
         total_processing_time_ms=total_time
     )
+    
+    return ORJSONResponse(content=response.model_dump())
+
+
+# Resposta constante do root, serializada uma única vez
+_ROOT_JSON = orjson.dumps({
+    "message": f"Welcome to {settings.PROJECT_NAME}",
+    "version": settings.VERSION,
+    "docs": "/docs",
+    "health": "/api/v1/health"
+})
 
 
 @router.get("/", tags=["Root"])
@@ -260,9 +421,4 @@ async def root():
     """
     Root endpoint - API information
     """
-    return {
-        "message": f"Welcome to {settings.PROJECT_NAME}",
-        "version": settings.VERSION,
-        "docs": "/docs",
-        "health": "/api/v1/health"
-    }
+    return Response(content=_ROOT_JSON, media_type="application/json")
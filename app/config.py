@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
-from functools import lru_cache
-from typing import Set, List
+from functools import lru_cache, cached_property
+from typing import FrozenSet, List, Tuple
 
 
 class Settings(BaseSettings):
@@ -18,6 +18,7 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    BCRYPT_ROUNDS: int = 10
     API_KEY: str  # ← NOVO: chave da API
     
     # Ollama Configuration
@@ -28,12 +29,21 @@ class Settings(BaseSettings):
     
     # Image Processing
     MAX_IMAGE_SIZE_MB: int = 10
+    MAX_IMAGE_EDGE_PX: int = 1024  # maior lado enviado ao Ollama (0 desativa)
     ALLOWED_EXTENSIONS: str = "jpg,jpeg,png,webp"
     
+    # Batch Processing
+    MAX_BATCH_SIZE: int = 10  # imagens por requisição de batch
+    BATCH_CONCURRENCY: int = 5  # imagens processadas em paralelo por batch
+    
+    # Cache de predições (por hash da imagem)
+    PREDICTION_CACHE_SIZE: int = 1024
+    
     # Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = 10
     
-    # Redis (Optional)
+    # Redis (Optional) - rate limit por API key compartilhado entre workers
+    REDIS_ENABLED: bool = False
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
     REDIS_PASSWORD: str = ""
@@ -45,17 +55,19 @@ class Settings(BaseSettings):
     # Logging
     LOG_LEVEL: str = "INFO"
     
-    @property
-    def allowed_extensions_set(self) -> Set[str]:
-        """Converte string de extensões em set"""
-        return {f".{ext.strip()}" for ext in self.ALLOWED_EXTENSIONS.split(",")}
+    # Valores derivados: calculados no primeiro acesso e cacheados na instância
+    
+    @cached_property
+    def allowed_extensions_set(self) -> FrozenSet[str]:
+        """Converte string de extensões em frozenset"""
+        return frozenset(f".{ext.strip().lower()}" for ext in self.ALLOWED_EXTENSIONS.split(","))
     
-    @property
-    def cors_origins_list(self) -> list[str]:
-        """Converte string de CORS origins em lista"""
-        return [origin.strip() for origin in self.CORS_ORIGINS.split(",")]
+    @cached_property
+    def cors_origins_list(self) -> Tuple[str, ...]:
+        """Converte string de CORS origins em tupla"""
+        return tuple(origin.strip() for origin in self.CORS_ORIGINS.split(","))
     
-    @property
+    @cached_property
     def ollama_fallback_models_list(self) -> List[str]:
         """Converte string de fallback models em lista"""
         if not self.OLLAMA_FALLBACK_MODELS:
@@ -1,19 +1,18 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
+from functools import lru_cache
 from typing import Optional, Dict
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import HTTPException, Security, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import hashlib
 import logging
+import time
 
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # HTTP Bearer token
 security_scheme = HTTPBearer()
 
@@ -35,6 +34,30 @@ API_KEYS_DB: Dict[str, dict] = {
     # Adicione mais keys aqui ou carregue de banco de dados
 }
 
+# Índice por SHA-256 da key (calculado uma vez na importação): a busca
+# não compara a key em texto puro, evitando vazamento por timing
+_HASHED_KEYS: Dict[bytes, dict] = {
+    hashlib.sha256(key.encode()).digest(): data
+    for key, data in API_KEYS_DB.items()
+}
+
+
+@lru_cache()
+def _get_pwd_context():
+    """
+    Contexto de hashing de senhas (passlib importado apenas no primeiro uso)
+    
+    Returns:
+        CryptContext: Contexto bcrypt com rounds definidos em settings
+    """
+    from passlib.context import CryptContext
+    
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=settings.BCRYPT_ROUNDS
+    )
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -47,7 +70,7 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Returns:
         bool: True se senha correta
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return _get_pwd_context().verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
@@ -60,7 +83,7 @@ def get_password_hash(password: str) -> str:
     Returns:
         str: Hash bcrypt da senha
     """
-    return pwd_context.hash(password)
+    return _get_pwd_context().hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -76,12 +99,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     """
     to_encode = data.copy()
     
+    # Expiração em segundos desde epoch (formato do claim "exp")
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire_seconds = int(expires_delta.total_seconds())
     else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire_seconds = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": int(time.time()) + expire_seconds})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     
     return encoded_jwt
@@ -98,7 +122,13 @@ def decode_access_token(token: str) -> Optional[dict]:
         Optional[dict]: Payload do token ou None se inválido
     """
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        # jose valida "exp" (obrigatório) e lança ExpiredSignatureError se expirado
+        payload = jwt.decode(
+            token,
+            settings.SECRET_KEY,
+            algorithms=[settings.ALGORITHM],
+            options={"require_exp": True}
+        )
         return payload
     except JWTError as e:
         logger.warning(f"JWT decode error: {str(e)}")
@@ -123,7 +153,9 @@ async def verify_api_key(
     api_key = credentials.credentials
     
     # Verificar se key existe
-    if api_key not in API_KEYS_DB:
+    digest = hashlib.sha256(api_key.encode()).digest()
+    user_data = _HASHED_KEYS.get(digest)
+    if user_data is None:
         logger.warning(f"Invalid API key attempted: {api_key[:10]}...")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -132,7 +164,6 @@ async def verify_api_key(
         )
     
     # Verificar se key está ativa
-    user_data = API_KEYS_DB[api_key]
     if not user_data.get("active", False):
         logger.warning(f"Inactive API key attempted: {user_data.get('name')}")
         raise HTTPException(
@@ -141,7 +172,8 @@ async def verify_api_key(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    logger.info(f"API key validated for user: {user_data.get('name')}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("API key validated for user: %s", user_data.get('name'))
     
     return {
         "api_key": api_key,
@@ -175,15 +207,6 @@ async def verify_jwt_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Verificar expiração
-    exp = payload.get("exp")
-    if exp is None or datetime.fromtimestamp(exp) < datetime.utcnow():
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token expired",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
     return payload
 
 
@@ -222,21 +245,92 @@ async def get_current_user(
     )
 
 
-def check_rate_limit(user_data: dict) -> bool:
+@lru_cache()
+def get_redis_client():
     """
-    Verifica rate limit do usuário (placeholder)
+    Cliente Redis assíncrono compartilhado (criado no primeiro uso)
     
-    Em produção, implementar com Redis
+    Returns:
+        redis.asyncio.Redis: Cliente com pool de conexões
+    """
+    import redis.asyncio as aioredis
+    
+    return aioredis.Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        password=settings.REDIS_PASSWORD or None,
+        db=settings.REDIS_DB
+    )
+
+
+async def check_rate_limit(user_data: dict) -> bool:
+    """
+    Verifica rate limit do usuário (janela de 1 minuto no Redis)
+    
+    Usa INCR + EXPIRE em pipeline por API key, compartilhando o limite
+    entre todos os workers. Com o Redis desativado a requisição é
+    permitida (vale o limite global por IP do slowapi). Com o Redis ativo
+    as rotas de OCR ficam fora do limite por IP, então uma falha do Redis
+    bloqueia a requisição (fail closed) em vez de deixá-la sem limite.
     
     Args:
         user_data: Dados do usuário
     
     Returns:
         bool: True se dentro do limite
+    
+    Raises:
+        HTTPException: 503 se o Redis estiver indisponível
     """
-    # TODO: Implementar com Redis
-    # Por enquanto, sempre permite
-    return True
+    if not settings.REDIS_ENABLED:
+        return True
+    
+    # Digest da key no nome da chave: a API key em texto puro não fica
+    # visível via KEYS/MONITOR nem persistida em RDB/AOF
+    key_digest = hashlib.sha256(user_data.get('api_key', '').encode()).hexdigest()
+    bucket = int(time.time() // 60)
+    key = f"rl:{key_digest}:{bucket}"
+    
+    try:
+        pipe = get_redis_client().pipeline()
+        pipe.incr(key)
+        pipe.expire(key, 60)
+        count, _ = await pipe.execute()
+    except Exception as e:
+        logger.error("Rate limit check failed, Redis unavailable: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Rate limiting service unavailable",
+            headers={"Retry-After": "60"},
+        )
+    
+    return count <= user_data.get("rate_limit", settings.RATE_LIMIT_PER_MINUTE)
+
+
+async def require_rate_limit(
+    user: dict = Depends(verify_api_key)
+) -> dict:
+    """
+    Dependency que aplica o rate limit da API key
+    
+    Args:
+        user: Dados do usuário
+    
+    Returns:
+        dict: Dados do usuário
+    
+    Raises:
+        HTTPException: 429 se o limite por minuto for excedido,
+            503 se o Redis estiver indisponível
+    """
+    if not await check_rate_limit(user):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(60 - int(time.time()) % 60)},
+        )
+    
+    return user
 
 
 async def require_premium_tier(
@@ -1,25 +1,59 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
+import asyncio
 import logging
+import logging.handlers
+import orjson
+import queue
 import time
 
 from app.config import get_settings
 from app.api import routes
+from app.core.security import get_redis_client
 
-# Configurar logging
+# Configurar logging: as requisições apenas enfileiram os registros e
+# um QueueListener em thread própria faz a escrita em console/arquivo
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    logging.StreamHandler(),
+    logging.handlers.RotatingFileHandler(
+        'latex-ocr-api.log',
+        maxBytes=50 * 1024 * 1024,  # 50MB por arquivo
+        backupCount=5
+    ),
+    respect_handler_level=True
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('latex-ocr-api.log')
-    ]
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
 )
+_log_listener_running = False
+
+
+def _start_log_listener():
+    """Inicia a thread de escrita dos logs (sem efeito se já estiver ativa)"""
+    global _log_listener_running
+    if not _log_listener_running:
+        _log_listener.start()
+        _log_listener_running = True
+
+
+def _stop_log_listener():
+    """Descarrega a fila e para a thread de logs (sem efeito se já parada)"""
+    global _log_listener_running
+    if _log_listener_running:
+        _log_listener.stop()
+        _log_listener_running = False
+
+
+_start_log_listener()
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -27,7 +61,8 @@ settings = get_settings()
 # Configurar log level do .env
 logging.getLogger().setLevel(settings.LOG_LEVEL)
 
-# Rate limiter
+# Rate limiter global por IP (o limite por API key é aplicado via Redis
+# na dependency require_rate_limit, e substitui este nas rotas de OCR)
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=[f"{settings.RATE_LIMIT_PER_MINUTE}/minute"]
@@ -61,7 +96,8 @@ app = FastAPI(
     """,
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    default_response_class=ORJSONResponse
 )
 
 # Adicionar rate limiter ao app state
@@ -81,6 +117,39 @@ app.add_middleware(
 )
 
 
+# Limite de Content-Length por rota de upload (margem para o envelope multipart)
+_MULTIPART_OVERHEAD = 64 * 1024
+_MAX_UPLOAD_BYTES = settings.MAX_IMAGE_SIZE_MB * 1024 * 1024 + _MULTIPART_OVERHEAD
+_MAX_BODY_BYTES = {
+    f"{settings.API_V1_PREFIX}/ocr/latex": _MAX_UPLOAD_BYTES,
+    f"{settings.API_V1_PREFIX}/ocr/latex/batch": _MAX_UPLOAD_BYTES * settings.MAX_BATCH_SIZE,
+}
+
+
+# Middleware: rejeitar uploads grandes pelo header Content-Length
+@app.middleware("http")
+async def check_content_length(request: Request, call_next):
+    """
+    Middleware que rejeita corpos acima do limite antes de ler qualquer byte
+    
+    Precisa ser middleware (e não dependency): o FastAPI faz o parse do
+    multipart antes de resolver as dependencies da rota.
+    """
+    max_body = _MAX_BODY_BYTES.get(request.url.path)
+    content_length = request.headers.get("content-length")
+    
+    if max_body is not None and content_length and content_length.isdigit():
+        if int(content_length) > max_body:
+            return ORJSONResponse(
+                status_code=413,
+                content={
+                    "detail": f"Request body too large. Maximum image size: {settings.MAX_IMAGE_SIZE_MB}MB"
+                }
+            )
+    
+    return await call_next(request)
+
+
 # Middleware: Request timing e logging
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
@@ -90,7 +159,7 @@ async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
     
     # Log da requisição
-    logger.info(f"Request: {request.method} {request.url.path}")
+    logger.info("Request: %s %s", request.method, request.url.path)
     
     try:
         response = await call_next(request)
@@ -101,14 +170,14 @@ async def add_process_time_header(request: Request, call_next):
         
         # Log da resposta
         logger.info(
-            f"Response: {request.method} {request.url.path} - "
-            f"Status: {response.status_code} - Time: {process_time:.2f}ms"
+            "Response: %s %s - Status: %s - Time: %.2fms",
+            request.method, request.url.path, response.status_code, process_time
         )
         
         return response
         
     except Exception as e:
-        logger.error(f"Request failed: {request.method} {request.url.path} - Error: {str(e)}")
+        logger.error("Request failed: %s %s - Error: %s", request.method, request.url.path, e)
         raise
 
 
@@ -116,7 +185,7 @@ async def add_process_time_header(request: Request, call_next):
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc):
     """Handler para 404 Not Found"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=404,
         content={
             "success": False,
@@ -131,7 +200,7 @@ async def not_found_handler(request: Request, exc):
 async def internal_error_handler(request: Request, exc):
     """Handler para 500 Internal Server Error"""
     logger.error(f"Internal server error: {str(exc)}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "success": False,
@@ -148,6 +217,9 @@ async def startup_event():
     """
     Executa ao iniciar a aplicação
     """
+    # Reiniciar a escrita dos logs caso um shutdown anterior a tenha parado
+    _start_log_listener()
+    
     logger.info("="*50)
     logger.info(f"Starting {settings.PROJECT_NAME} v{settings.VERSION}")
     logger.info(f"Debug mode: {settings.DEBUG}")
@@ -157,19 +229,24 @@ async def startup_event():
     logger.info(f"Rate Limit: {settings.RATE_LIMIT_PER_MINUTE}/min")
     logger.info("="*50)
     
-    # Verificar conexão com Ollama
-    from app.models.ollama_client import OllamaOCR
-    ollama_client = OllamaOCR(
-        base_url=settings.OLLAMA_BASE_URL,
-        model=settings.OLLAMA_MODEL,
-        fallback_models=settings.ollama_fallback_models_list
+    # Verificar conexão com Ollama (reutiliza o cliente único das rotas,
+    # compartilhando a mesma conexão em vez de abrir um segundo cliente)
+    ollama_client = routes.ollama_client
+    
+    # Conexão e modelos verificados em paralelo, fora do event loop
+    connected, models_status = await asyncio.gather(
+        asyncio.to_thread(ollama_client.check_connection),
+        asyncio.to_thread(ollama_client.check_all_models),
+        return_exceptions=True
     )
     
-    if ollama_client.check_connection():
+    if connected is True:
         logger.info(" Ollama connection successful")
         
         # Verificar modelos disponíveis
-        models_status = ollama_client.check_all_models()
+        if isinstance(models_status, Exception):
+            logger.warning(f"Could not list Ollama models: {str(models_status)}")
+            models_status = {"available_models": [], "status": {}}
         logger.info(f"Available models: {models_status['available_models']}")
         
         for model, available in models_status['status'].items():
@@ -177,6 +254,9 @@ async def startup_event():
             logger.info(f"{status_icon} Model '{model}': {'Available' if available else 'Not found'}")
     else:
         logger.warning("⚠️  Ollama connection failed - API will have limited functionality")
+    
+    # Monitorar conexão com Ollama em background (snapshot lido pelo /health)
+    app.state.health_task = asyncio.create_task(routes.poll_ollama_health())
 
 
 # Shutdown event
@@ -186,6 +266,18 @@ async def shutdown_event():
     Executa ao desligar a aplicação
     """
     logger.info(f"Shutting down {settings.PROJECT_NAME}")
+    
+    # Encerrar monitoramento do Ollama
+    health_task = getattr(app.state, "health_task", None)
+    if health_task is not None:
+        health_task.cancel()
+    
+    # Fechar pool de conexões do Redis (rate limit por API key)
+    if settings.REDIS_ENABLED:
+        await get_redis_client().aclose()
+    
+    # Descarregar registros pendentes da fila de logging
+    _stop_log_listener()
 
 
 # Incluir rotas
@@ -195,6 +287,31 @@ app.include_router(
     tags=["API v1"]
 )
 
+# Com Redis ativo, as rotas de OCR usam apenas o limite por API key
+# (require_rate_limit); o limite global por IP não pode se sobrepor a ele.
+# Se o Redis cair, require_rate_limit responde 503 (fail closed)
+if settings.REDIS_ENABLED:
+    limiter.exempt(routes.ocr_latex)
+    limiter.exempt(routes.ocr_latex_batch)
+
+
+# Resposta constante do root, serializada uma única vez
+_ROOT_JSON = orjson.dumps({
+    "message": f"Welcome to {settings.PROJECT_NAME}",
+    "version": settings.VERSION,
+    "status": "online",
+    "documentation": {
+        "swagger": "/docs",
+        "redoc": "/redoc",
+        "openapi": "/openapi.json"
+    },
+    "endpoints": {
+        "health": f"{settings.API_V1_PREFIX}/health",
+        "ocr": f"{settings.API_V1_PREFIX}/ocr/latex",
+        "batch": f"{settings.API_V1_PREFIX}/ocr/latex/batch"
+    }
+})
+
 
 # Root endpoint
 @app.get("/", tags=["Root"])
@@ -202,21 +319,7 @@ async def root():
     """
     Root endpoint - API information
     """
-    return {
-        "message": f"Welcome to {settings.PROJECT_NAME}",
-        "version": settings.VERSION,
-        "status": "online",
-        "documentation": {
-            "swagger": "/docs",
-            "redoc": "/redoc",
-            "openapi": "/openapi.json"
-        },
-        "endpoints": {
-            "health": f"{settings.API_V1_PREFIX}/health",
-            "ocr": f"{settings.API_V1_PREFIX}/ocr/latex",
-            "batch": f"{settings.API_V1_PREFIX}/ocr/latex/batch"
-        }
-    }
+    return Response(content=_ROOT_JSON, media_type="application/json")
 
 
 # Desenvolvimento: ponto de entrada
@@ -1,17 +1,41 @@
 from PIL import Image
 from io import BytesIO
 from fastapi import UploadFile, HTTPException
+import asyncio
 import logging
-from typing import Tuple
+from typing import FrozenSet, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
+# Tamanho do bloco de leitura do upload (64KB)
+READ_CHUNK_SIZE = 64 * 1024
+
+# Extensões aceitas por padrão (imutável, já em minúsculas)
+DEFAULT_ALLOWED_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".webp"})
+
+# Magic bytes dos formatos suportados -> extensões correspondentes
+# (WebP: "RIFF" + tamanho de 4 bytes + "WEBP", tratado à parte)
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", frozenset({".jpg", ".jpeg"})),
+    (b"\x89PNG\r\n\x1a\n", frozenset({".png"})),
+)
+_WEBP_EXTENSIONS = frozenset({".webp"})
+_SIGNATURE_SIZE = 12
+
+# Formato e parâmetros usados ao re-encodar imagens reduzidas, por formato
+# de origem (demais formatos são re-encodados em PNG)
+_REENCODE_PARAMS = {
+    "JPEG": ("JPEG", {"quality": 90}),
+    "WEBP": ("WEBP", {"quality": 90}),
+}
+
 
 async def validate_and_process_image(
     file: UploadFile,
     max_size_mb: int = 10,
-    allowed_extensions: set = {".jpg", ".jpeg", ".png", ".webp"}
-) -> Tuple[Image.Image, bytes]:
+    allowed_extensions: FrozenSet[str] = DEFAULT_ALLOWED_EXTENSIONS,
+    max_dimension: int = 1024
+) -> Tuple[Image.Image, bytes, dict]:
     """
     Valida e processa imagem do upload
     
@@ -19,9 +43,11 @@ async def validate_and_process_image(
         file: Arquivo enviado via FastAPI
         max_size_mb: Tamanho máximo em MB
         allowed_extensions: Extensões permitidas
+        max_dimension: Maior lado permitido em pixels (0 desativa o resize)
     
     Returns:
-        Tuple[Image.Image, bytes]: (PIL Image, bytes da imagem)
+        Tuple[Image.Image, bytes, dict]: (PIL Image, bytes da imagem,
+            informações da imagem original enviada)
     
     Raises:
         HTTPException: Se validação falhar
@@ -33,60 +59,169 @@ async def validate_and_process_image(
             detail="Filename is required"
         )
     
-    # Validar extensão
-    file_ext = "." + file.filename.split(".")[-1].lower()
+    # Validar extensão (rpartition: sem lista intermediária de segmentos)
+    file_ext = "." + file.filename.rpartition(".")[2].lower()
     if file_ext not in allowed_extensions:
         raise HTTPException(
             status_code=400,
             detail=f"Invalid file type '{file_ext}'. Allowed: {', '.join(allowed_extensions)}"
         )
     
-    # Ler conteúdo
-    try:
-        contents = await file.read()
-    except Exception as e:
-        logger.error(f"Error reading file: {str(e)}")
+    max_bytes = max_size_mb * 1024 * 1024
+    
+    # O Starlette já gravou a parte multipart em um SpooledTemporaryFile
+    # (em disco acima de 1MB): rejeitar pelo tamanho conhecido sem ler nada
+    if file.size is not None and file.size > max_bytes:
         raise HTTPException(
-            status_code=400,
-            detail="Error reading uploaded file"
+            status_code=413,
+            detail=f"File too large ({file.size / (1024 * 1024):.2f}MB). Maximum size: {max_size_mb}MB"
         )
     
-    # Validar tamanho
-    size_mb = len(contents) / (1024 * 1024)
-    if size_mb > max_size_mb:
+    # Validar o conteúdo pelos magic bytes antes de ler o arquivo inteiro
+    header = await _read_upload(file, _SIGNATURE_SIZE)
+    await file.seek(0)
+    if not (sniff_image_extensions(header) & allowed_extensions):
         raise HTTPException(
-            status_code=413,
-            detail=f"File too large ({size_mb:.2f}MB). Maximum size: {max_size_mb}MB"
+            status_code=400,
+            detail=f"File content is not a valid image. Allowed: {', '.join(allowed_extensions)}"
         )
     
-    # Validar se é imagem válida
-    try:
-        image = Image.open(BytesIO(contents))
-        
-        # Verificar se imagem está corrompida
-        image.verify()
-        
-        # Reabrir (verify() fecha a imagem)
-        image = Image.open(BytesIO(contents))
+    if file.size is not None:
+        # Tamanho já validado: uma única leitura direto para bytes, sem
+        # bytearray intermediário (evita duas cópias da imagem na memória)
+        contents = await _read_upload(file)
+    else:
+        # Tamanho desconhecido: ler em blocos, rejeitando assim que o
+        # limite for excedido
+        buffer = bytearray()
         
-        # Converter para RGB se necessário
-        if image.mode not in ("RGB", "L"):
-            logger.info(f"Converting image from {image.mode} to RGB")
-            image = image.convert("RGB")
+        while chunk := await _read_upload(file, READ_CHUNK_SIZE):
+            buffer.extend(chunk)
+            
+            # Validar tamanho
+            if len(buffer) > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Maximum size: {max_size_mb}MB"
+                )
         
-        logger.info(
-            f"Image validated successfully: {file.filename}, "
-            f"size: {size_mb:.2f}MB, dimensions: {image.size}, mode: {image.mode}"
+        contents = bytes(buffer)
+    
+    size_mb = len(contents) / (1024 * 1024)
+    
+    # Validar se é imagem válida (decodificação fora do event loop)
+    try:
+        image, contents, image_info = await asyncio.to_thread(
+            _decode_image, contents, max_dimension
         )
-        
-        return image, contents
-        
     except Exception as e:
         logger.error(f"Invalid image file: {str(e)}")
         raise HTTPException(
             status_code=400,
             detail=f"Invalid or corrupted image file: {str(e)}"
         )
+    
+    logger.info(
+        "Image validated successfully: %s, size: %.2fMB, dimensions: %s, mode: %s",
+        file.filename, size_mb, image.size, image.mode
+    )
+    
+    return image, contents, image_info
+
+
+def sniff_image_extensions(header: bytes) -> FrozenSet[str]:
+    """
+    Identifica o formato da imagem pelos primeiros bytes (magic bytes)
+    
+    Args:
+        header: Primeiros 12 bytes do arquivo
+    
+    Returns:
+        FrozenSet[str]: Extensões do formato detectado (vazio se desconhecido)
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return _WEBP_EXTENSIONS
+    
+    for signature, extensions in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extensions
+    
+    return frozenset()
+
+
+async def _read_upload(file: UploadFile, size: int = -1) -> bytes:
+    """
+    Lê bytes do upload convertendo falhas de leitura em HTTP 400
+    
+    Args:
+        file: Arquivo enviado via FastAPI
+        size: Quantidade de bytes a ler (-1 lê até o fim)
+    
+    Returns:
+        bytes: Conteúdo lido (vazio no fim do arquivo)
+    """
+    try:
+        return await file.read(size)
+    except Exception as e:
+        logger.error(f"Error reading file: {str(e)}")
+        raise HTTPException(
+            status_code=400,
+            detail="Error reading uploaded file"
+        )
+
+
+def _decode_image(contents: bytes, max_dimension: int) -> Tuple[Image.Image, bytes, dict]:
+    """
+    Decodifica e normaliza a imagem (CPU-bound, executada em thread)
+    
+    Args:
+        contents: Bytes da imagem enviada
+        max_dimension: Maior lado permitido em pixels (0 desativa o resize)
+    
+    Returns:
+        Tuple[Image.Image, bytes, dict]: (PIL Image, bytes a enviar ao Ollama,
+            informações da imagem original)
+    """
+    image = Image.open(BytesIO(contents))
+    source_format = image.format
+    
+    # Dimensões/formato do upload, lidos do cabeçalho antes do resize
+    image_info = get_image_info(image)
+    
+    # JPEG: decodificar já em escala reduzida (DCT do libjpeg, 1/2 a 1/8)
+    # quando a imagem for muito maior que o tamanho final. O alvo mantém
+    # o aspect ratio para que imagens largas/altas também sejam reduzidas
+    # (em 4:3 como 2048x1536 o resultado já é o tamanho final, 1024x768)
+    if source_format == "JPEG" and max_dimension:
+        width, height = image.size  # lido do cabeçalho, sem decodificar
+        scale = max_dimension / max(width, height)
+        if scale < 1:
+            image.draft("RGB", (max(1, int(width * scale)), max(1, int(height * scale))))
+    
+    # Decodificar uma única vez (load() falha se a imagem estiver corrompida)
+    image.load()
+    
+    # Converter para RGB se necessário
+    if image.mode not in ("RGB", "L"):
+        logger.info("Converting image from %s to RGB", image.mode)
+        image = image.convert("RGB")
+    
+    # Reduzir imagens grandes antes de enviar ao Ollama: menos bytes
+    # em Base64 e menos tokens de visão por requisição
+    if max_dimension and max(image.size) > max_dimension:
+        image = resize_image_if_needed(image, max_dimension)
+    
+    # Re-encodar sempre que draft ou resize mudaram o tamanho em relação ao
+    # cabeçalho (o draft pode já decodificar no tamanho final, sem resize)
+    if image.size != (image_info["width"], image_info["height"]):
+        # Formato de origem (PNG em fotos JPEG aumentaria o payload); os
+        # bytes enviados sempre descrevem a imagem reduzida
+        save_format, save_params = _REENCODE_PARAMS.get(source_format, ("PNG", {}))
+        resized_bytes = BytesIO()
+        image.save(resized_bytes, format=save_format, **save_params)
+        contents = resized_bytes.getvalue()
+    
+    return image, contents, image_info
 
 
 def validate_image_dimensions(
@@ -147,22 +282,35 @@ def resize_image_if_needed(
         new_height = max_dimension
         new_width = int(width * (max_dimension / height))
     
-    logger.info(f"Resizing image from {width}x{height} to {new_width}x{new_height}")
+    logger.info("Resizing image from %dx%d to %dx%d", width, height, new_width, new_height)
     
-    resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    # reducing_gap: reduz primeiro por fator inteiro (média de blocos, como
+    # INTER_AREA) e aplica LANCZOS só no ajuste final, bem mais rápido
+    resized = image.resize(
+        (new_width, new_height),
+        Image.Resampling.LANCZOS,
+        reducing_gap=3.0
+    )
     return resized
 
 
-def get_image_info(image: Image.Image) -> dict:
+def get_image_info(image: Union[Image.Image, bytes]) -> dict:
     """
     Extrai informações da imagem
     
+    Aceita bytes para ler apenas o cabeçalho: dimensões, modo e formato
+    ficam disponíveis sem decodificar os pixels.
+    
     Args:
-        image: PIL Image
+        image: PIL Image ou bytes da imagem
     
     Returns:
         dict: Informações da imagem
     """
+    if isinstance(image, (bytes, bytearray)):
+        with Image.open(BytesIO(image)) as img:
+            return get_image_info(img)
+    
     width, height = image.size
     
     info = {
@@ -179,8 +327,9 @@ def get_image_info(image: Image.Image) -> dict:
 async def validate_batch_images(
     files: list[UploadFile],
     max_size_mb: int = 10,
-    allowed_extensions: set = {".jpg", ".jpeg", ".png", ".webp"},
-    max_batch_size: int = 10
+    allowed_extensions: FrozenSet[str] = DEFAULT_ALLOWED_EXTENSIONS,
+    max_batch_size: int = 10,
+    max_dimension: int = 1024
 ) -> list[Tuple[Image.Image, bytes, str]]:
     """
     Valida múltiplas imagens em batch
@@ -190,6 +339,7 @@ async def validate_batch_images(
         max_size_mb: Tamanho máximo por imagem
         allowed_extensions: Extensões permitidas
         max_batch_size: Máximo de imagens no batch
+        max_dimension: Maior lado permitido em pixels (0 desativa o resize)
     
     Returns:
         list[Tuple[Image.Image, bytes, str]]: Lista de (imagem, bytes, filename)
@@ -209,24 +359,36 @@ async def validate_batch_images(
             detail="No files provided"
         )
     
-    results = []
-    
-    for idx, file in enumerate(files):
+    async def _validate_one(idx: int, file: UploadFile) -> Tuple[Image.Image, bytes, str]:
         try:
-            image, image_bytes = await validate_and_process_image(
+            image, image_bytes, _ = await validate_and_process_image(
                 file,
                 max_size_mb,
-                allowed_extensions
+                allowed_extensions,
+                max_dimension
             )
-            results.append((image, image_bytes, file.filename))
-            
         except HTTPException as e:
             # Re-raise com informação do índice
             raise HTTPException(
                 status_code=e.status_code,
                 detail=f"File {idx + 1} ({file.filename}): {e.detail}"
             )
+        
+        return image, image_bytes, file.filename
+    
+    # Validar todas as imagens em paralelo
+    outcomes = await asyncio.gather(
+        *[_validate_one(idx, file) for idx, file in enumerate(files)],
+        return_exceptions=True
+    )
+    
+    # Reportar o primeiro arquivo inválido, na ordem do upload
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    
+    results = list(outcomes)
     
-    logger.info(f"Batch validation successful: {len(results)} images")
+    logger.info("Batch validation successful: %d images", len(results))
     
     return results
@@ -1,9 +1,40 @@
 import re
 import logging
+from functools import lru_cache
 from typing import Tuple
 
 logger = logging.getLogger(__name__)
 
+# Regex compiladas uma única vez na importação do módulo
+# Cercas markdown: "```latex" no início de linha, linha só com "```" e
+# "```" no início do texto. Passadas em sequência, pois cada uma atua
+# sobre o resultado da anterior (ex.: "```latex```" -> "```" -> "")
+_RE_FENCE_OPEN = re.compile(r'^```latex\s*', re.MULTILINE)
+_RE_FENCE_LINE = re.compile(r'^```\s*$', re.MULTILINE)
+_RE_FENCE_START = re.compile(r'\A```')
+_RE_BLANK_LINES = re.compile(r'\n\s*\n')
+_RE_CMD_SPACE = re.compile(r'\\\s+([a-zA-Z]+)')
+_RE_BRACKETS = re.compile(r'[{}\[\]()]')
+_RE_LEFT_RIGHT = re.compile(r'\\(left|right)(?![a-zA-Z])')
+
+# Pares de brackets (abertura -> fechamento)
+_BRACKET_PAIRS = {
+    '{': '}',
+    '[': ']',
+    '(': ')'
+}
+
+# Comandos que precisam de argumentos
+_COMMANDS_WITH_ARGS = [
+    r'\\frac', r'\\sqrt', r'\\sum', r'\\int',
+    r'\\left', r'\\right', r'\\over'
+]
+# Todos os comandos em uma única regex (uma passada sobre o texto);
+# o grupo capturado (lastindex) identifica o comando na lista acima
+_RE_INCOMPLETE_COMMAND = re.compile(
+    '(?:' + '|'.join(f'({cmd})' for cmd in _COMMANDS_WITH_ARGS) + r')\s*(?![{(\[])'
+)
+
 
 def clean_latex(latex_code: str) -> str:
     """
@@ -16,21 +47,19 @@ def clean_latex(latex_code: str) -> str:
         str: LaTeX limpo
     """
     # Remove markdown code blocks
-    latex_code = re.sub(r'^```latex\s*', '', latex_code, flags=re.MULTILINE)
-    latex_code = re.sub(r'^```\s*$', '', latex_code, flags=re.MULTILINE)
-    latex_code = re.sub(r'^```', '', latex_code)
+    latex_code = _RE_FENCE_OPEN.sub('', latex_code)
+    latex_code = _RE_FENCE_LINE.sub('', latex_code)
+    latex_code = _RE_FENCE_START.sub('', latex_code, count=1)
     
-    # Remove dollar signs únicos (inline math)
+    # Remove dollar signs das pontas (inline $ e display $$: strip remove
+    # qualquer sequência de '$', então uma passada cobre os dois casos)
     latex_code = latex_code.strip('$')
     
-    # Remove double dollar signs (display math)
-    latex_code = latex_code.strip('$$')
-    
     # Remove espaços extras
     latex_code = latex_code.strip()
     
     # Remove múltiplas linhas em branco
-    latex_code = re.sub(r'\n\s*\n', '\n', latex_code)
+    latex_code = _RE_BLANK_LINES.sub('\n', latex_code)
     
     return latex_code
 
@@ -60,28 +89,28 @@ def validate_brackets(latex_code: str) -> Tuple[bool, str]:
     Returns:
         Tuple[bool, str]: (is_valid, error_message)
     """
-    # Pares de brackets
-    pairs = {
-        '{': '}',
-        '[': ']',
-        '(': ')'
-    }
-    
+    # Pilha só com as posições das aberturas (o caractere é lido de
+    # latex_code[pos] quando necessário, sem alocar uma tupla por push)
     stack = []
     
-    for i, char in enumerate(latex_code):
-        if char in pairs.keys():
-            stack.append((char, i))
-        elif char in pairs.values():
+    # Varredura em C pelo regex: o loop Python só visita os brackets
+    for match in _RE_BRACKETS.finditer(latex_code):
+        char = match.group()
+        i = match.start()
+        
+        if char in _BRACKET_PAIRS:
+            stack.append(i)
+        else:
             if not stack:
                 return False, f"Unmatched closing bracket '{char}' at position {i}"
             
-            opening, pos = stack.pop()
-            if pairs[opening] != char:
+            pos = stack.pop()
+            opening = latex_code[pos]
+            if _BRACKET_PAIRS[opening] != char:
                 return False, f"Mismatched brackets: '{opening}' at {pos} and '{char}' at {i}"
     
     if stack:
-        unclosed = ', '.join([f"'{b}' at position {b}" for b in stack])[1]
+        unclosed = ', '.join(f"'{latex_code[pos]}' at position {pos}" for pos in stack)
         return False, f"Unclosed brackets: {unclosed}"
     
     return True, ""
@@ -97,17 +126,12 @@ def validate_latex_commands(latex_code: str) -> Tuple[bool, str]:
     Returns:
         Tuple[bool, str]: (is_valid, error_message)
     """
-    # Comandos que precisam de argumentos
-    commands_with_args = [
-        r'\\frac', r'\\sqrt', r'\\sum', r'\\int',
-        r'\\left', r'\\right', r'\\over'
-    ]
-    
-    for cmd in commands_with_args:
-        # Verifica se comando existe sem argumentos apropriados
-        pattern = rf'{cmd}\s*(?![{{(\[])'
-        if re.search(pattern, latex_code):
-            return False, f"Command '{cmd}' appears to be incomplete"
+    # Verifica se comando existe sem argumentos apropriados
+    found = {match.lastindex - 1 for match in _RE_INCOMPLETE_COMMAND.finditer(latex_code)}
+    if found:
+        # Reporta na mesma ordem de prioridade da lista de comandos
+        cmd = _COMMANDS_WITH_ARGS[min(found)]
+        return False, f"Command '{cmd}' appears to be incomplete"
     
     return True, ""
 
@@ -143,6 +167,30 @@ def validate_latex(latex_code: str, strict: bool = False) -> Tuple[bool, str]:
     return True, ""
 
 
+@lru_cache(maxsize=4096)
+def _post_process_cached(latex_code: str) -> Tuple[str, str, bool, Tuple[str, ...]]:
+    """
+    Núcleo puro de post_process_latex, memoizado pelo LaTeX bruto
+    
+    Args:
+        latex_code: Código LaTeX bruto do modelo
+    
+    Returns:
+        Tuple[str, str, bool, Tuple[str, ...]]: (cleaned, rendered, is_valid, erros)
+    """
+    # Limpar
+    cleaned = clean_latex(latex_code)
+    
+    # Versão para renderização
+    rendered = remove_display_math_delimiters(cleaned)
+    
+    # Validar
+    is_valid, error_msg = validate_latex(cleaned, strict=False)
+    validation_errors = () if is_valid else (error_msg,)
+    
+    return cleaned, rendered, is_valid, validation_errors
+
+
 def post_process_latex(latex_code: str) -> dict:
     """
     Processa LaTeX e retorna versões limpas
@@ -159,28 +207,17 @@ def post_process_latex(latex_code: str) -> dict:
             'validation_errors': lista de erros
         }
     """
-    validation_errors = []
-    
-    # Limpar
-    cleaned = clean_latex(latex_code)
-    
-    # Versão para renderização
-    rendered = remove_display_math_delimiters(cleaned)
-    
-    # Validar
-    is_valid, error_msg = validate_latex(cleaned, strict=False)
-    if not is_valid:
-        validation_errors.append(error_msg)
+    cleaned, rendered, is_valid, validation_errors = _post_process_cached(latex_code)
     
     result = {
         'original': latex_code,
         'cleaned': cleaned,
         'rendered': rendered,
         'is_valid': is_valid,
-        'validation_errors': validation_errors
+        'validation_errors': list(validation_errors)
     }
     
-    logger.debug(f"LaTeX post-processing: {result}")
+    logger.debug("LaTeX post-processing: %s", result)
     
     return result
 
@@ -196,17 +233,19 @@ def fix_common_issues(latex_code: str) -> str:
         str: LaTeX corrigido
     """
     # Remove espaços extras dentro de comandos
-    latex_code = re.sub(r'\\\s+([a-zA-Z]+)', r'\\\1', latex_code)
+    latex_code = _RE_CMD_SPACE.sub(r'\\\1', latex_code)
     
-    # Corrige \left e \right sem par
-    left_count = latex_code.count(r'\left')
-    right_count = latex_code.count(r'\right')
+    # Corrige \left e \right sem par (contagem em uma única passada;
+    # ignora comandos como \leftarrow e \rightarrow)
+    delimiters = _RE_LEFT_RIGHT.findall(latex_code)
+    left_count = delimiters.count('left')
+    right_count = len(delimiters) - left_count
     
     if left_count > right_count:
         # Adiciona \right. no final
-        latex_code += r'\right.' * (left_count - right_count)
+        return ''.join((latex_code, r'\right.' * (left_count - right_count)))
     elif right_count > left_count:
         # Adiciona \left. no início
-        latex_code = r'\left.' * (right_count - left_count) + latex_code
+        return ''.join((r'\left.' * (right_count - left_count), latex_code))
     
     return latex_code
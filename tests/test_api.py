@@ -1,10 +1,19 @@
 import pytest
+import asyncio
+import httpx
 from fastapi.testclient import TestClient
+from collections import OrderedDict
+from functools import lru_cache
 from PIL import Image
 import io
+import orjson
+
+from fastapi import HTTPException
 
 from app.main import app
 from app.config import get_settings
+from app.core import security
+from app.api import routes
 
 client = TestClient(app)
 settings = get_settings()
@@ -14,15 +23,22 @@ TEST_API_KEY = "test-key-123"
 HEADERS = {"Authorization": f"Bearer {TEST_API_KEY}"}
 
 
-def create_test_image(width=200, height=100, color=(255, 255, 255)):
+@lru_cache()
+def _encode_test_image(width, height, color):
     """
-    Cria uma imagem de teste
+    Codifica a imagem de teste em PNG (uma vez por combinação de parâmetros)
     """
     image = Image.new('RGB', (width, height), color)
     img_byte_arr = io.BytesIO()
     image.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)
-    return img_byte_arr
+    return img_byte_arr.getvalue()
+
+
+def create_test_image(width=200, height=100, color=(255, 255, 255)):
+    """
+    Cria uma imagem de teste
+    """
+    return io.BytesIO(_encode_test_image(width, height, color))
 
 
 class TestHealthEndpoints:
@@ -32,7 +48,7 @@ class TestHealthEndpoints:
         """Testa endpoint raiz"""
         response = client.get("/")
         assert response.status_code == 200
-        data = response.json()
+        data = orjson.loads(response.content)
         assert "message" in data
         assert "version" in data
         assert data["version"] == settings.VERSION
@@ -41,7 +57,7 @@ class TestHealthEndpoints:
         """Testa health check"""
         response = client.get(f"{settings.API_V1_PREFIX}/health")
         assert response.status_code == 200
-        data = response.json()
+        data = orjson.loads(response.content)
         assert "status" in data
         assert "ollama_connected" in data
         assert "version" in data
@@ -58,7 +74,7 @@ class TestHealthEndpoints:
             headers=HEADERS
         )
         assert response.status_code == 200
-        data = response.json()
+        data = orjson.loads(response.content)
         assert "primary_model" in data
         assert "status" in data
 
@@ -102,7 +118,7 @@ class TestOCREndpoints:
         assert response.status_code in [200, 500]
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             assert "success" in data
             assert "latex" in data
             assert "processing_time_ms" in data
@@ -118,11 +134,14 @@ class TestOCREndpoints:
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             assert "metadata" in data
             if data["metadata"]:
                 assert "filename" in data["metadata"]
                 assert "model_used" in data["metadata"]
+                # Informações da imagem enviada (não da versão redimensionada)
+                assert data["metadata"]["image_info"]["width"] == 200
+                assert data["metadata"]["image_info"]["format"] == "PNG"
     
     def test_ocr_invalid_file_type(self):
         """Testa OCR com tipo de arquivo inválido"""
@@ -136,6 +155,22 @@ class TestOCREndpoints:
         )
         assert response.status_code == 400
     
+    def test_ocr_spoofed_extension(self):
+        """Testa OCR com extensão .png mas conteúdo de outro formato"""
+        # GIF válido (o Pillow decodificaria), mas fora dos formatos aceitos
+        gif_bytes = io.BytesIO()
+        Image.new('RGB', (200, 100), (255, 255, 255)).save(gif_bytes, format='GIF')
+        
+        response = client.post(
+            f"{settings.API_V1_PREFIX}/ocr/latex",
+            headers=HEADERS,
+            files={"file": ("fake.png", gif_bytes.getvalue(), "image/png")}
+        )
+        assert response.status_code == 400
+        assert orjson.loads(response.content)["detail"].startswith(
+            "File content is not a valid image"
+        )
+    
     def test_ocr_too_large_file(self):
         """Testa OCR com arquivo muito grande"""
         # Criar imagem grande (> MAX_IMAGE_SIZE_MB)
@@ -148,6 +183,32 @@ class TestOCREndpoints:
             files={"file": ("large.png", large_data, "image/png")}
         )
         assert response.status_code in [400, 413]
+    
+    def test_ocr_request_body_too_large(self):
+        """Testa rejeição pelo Content-Length acima do limite + margem multipart"""
+        large_size = settings.MAX_IMAGE_SIZE_MB * 1024 * 1024 + 128 * 1024
+        large_data = b"0" * large_size
+        
+        response = client.post(
+            f"{settings.API_V1_PREFIX}/ocr/latex",
+            headers=HEADERS,
+            files={"file": ("large.png", large_data, "image/png")}
+        )
+        assert response.status_code == 413
+        assert orjson.loads(response.content)["detail"].startswith(
+            "Request body too large"
+        )
+    
+    def test_ocr_request_body_too_large_checked_before_auth(self):
+        """Testa que o Content-Length é verificado antes da autenticação"""
+        large_size = settings.MAX_IMAGE_SIZE_MB * 1024 * 1024 + 128 * 1024
+        large_data = b"0" * large_size
+        
+        response = client.post(
+            f"{settings.API_V1_PREFIX}/ocr/latex",
+            files={"file": ("large.png", large_data, "image/png")}
+        )
+        assert response.status_code == 413  # e não 403 (sem Bearer token)
 
 
 class TestBatchOCR:
@@ -185,7 +246,7 @@ class TestBatchOCR:
         assert response.status_code in [200, 500]
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             assert "success" in data
             assert "results" in data
             assert "total_images" in data
@@ -207,25 +268,170 @@ class TestBatchOCR:
         assert response.status_code == 400
 
 
+class FakeOllamaClient:
+    """Cliente Ollama simulado: conta as chamadas de predict"""
+    
+    def __init__(self, model_used="primary-model"):
+        self.calls = []
+        self.model_used = model_used
+    
+    def predict(self, image, image_bytes, use_fallback=True):
+        self.calls.append((image_bytes, use_fallback))
+        return "x^2", 12.5, self.model_used
+
+
+@pytest.fixture
+def fake_ollama(monkeypatch):
+    """Substitui o cliente Ollama das rotas e isola o cache de predições"""
+    fake = FakeOllamaClient()
+    monkeypatch.setattr(routes, "ollama_client", fake)
+    monkeypatch.setattr(routes, "_PRED_CACHE", OrderedDict())
+    monkeypatch.setattr(routes, "_INFLIGHT", {})
+    return fake
+
+
+class TestPredictionCache:
+    """Testes do cache de predições"""
+    
+    @pytest.mark.asyncio
+    async def test_cache_hit_and_miss(self, fake_ollama):
+        """Testa que a mesma imagem reutiliza o resultado sem nova inferência"""
+        image_bytes = create_test_image().getvalue()
+        
+        first = await routes._predict(None, image_bytes, use_fallback=True)
+        second = await routes._predict(None, image_bytes, use_fallback=True)
+        
+        assert first == ("x^2", 12.5, "primary-model")
+        assert second == ("x^2", 0.0, "primary-model")
+        assert len(fake_ollama.calls) == 1
+        
+        # Imagem diferente: cache miss
+        other_bytes = create_test_image(color=(0, 0, 0)).getvalue()
+        await routes._predict(None, other_bytes, use_fallback=True)
+        assert len(fake_ollama.calls) == 2
+    
+    @pytest.mark.asyncio
+    async def test_cache_respects_use_fallback(self, fake_ollama):
+        """Testa que resultado de fallback não é servido com use_fallback=False"""
+        image_bytes = create_test_image().getvalue()
+        fake_ollama.model_used = "fallback-model"
+        
+        await routes._predict(None, image_bytes, use_fallback=True)
+        await routes._predict(None, image_bytes, use_fallback=False)
+        
+        assert fake_ollama.calls == [(image_bytes, True), (image_bytes, False)]
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_duplicates_share_inference(self, fake_ollama):
+        """Testa que requisições simultâneas da mesma imagem fazem uma inferência"""
+        image_bytes = create_test_image().getvalue()
+        
+        first, second = await asyncio.gather(
+            routes._predict(None, image_bytes, use_fallback=True),
+            routes._predict(None, image_bytes, use_fallback=True)
+        )
+        
+        assert len(fake_ollama.calls) == 1
+        assert first == second == ("x^2", 12.5, "primary-model")
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_do_not_share_across_use_fallback(self, fake_ollama):
+        """Testa que use_fallback diferente não compartilha a inferência em andamento"""
+        image_bytes = create_test_image().getvalue()
+        
+        await asyncio.gather(
+            routes._predict(None, image_bytes, use_fallback=True),
+            routes._predict(None, image_bytes, use_fallback=False)
+        )
+        
+        assert sorted(fake_ollama.calls) == [(image_bytes, False), (image_bytes, True)]
+
+
 class TestRateLimiting:
     """Testes de rate limiting"""
     
-    def test_rate_limit_exceeded(self):
+    @pytest.mark.asyncio
+    async def test_rate_limit_exceeded(self):
         """Testa excesso de rate limit"""
-        image = create_test_image()
+        image_bytes = create_test_image().getvalue()
         
-        # Fazer mais requisições que o limite
-        responses = []
-        for _ in range(settings.RATE_LIMIT_PER_MINUTE + 5):
-            response = client.post(
-                f"{settings.API_V1_PREFIX}/ocr/latex",
-                headers=HEADERS,
-                files={"file": ("test.png", create_test_image(), "image/png")}
-            )
-            responses.append(response.status_code)
+        # Fazer mais requisições que o limite (em paralelo)
+        async with httpx.AsyncClient(app=app, base_url="http://test") as async_client:
+            responses = await asyncio.gather(*[
+                async_client.post(
+                    f"{settings.API_V1_PREFIX}/ocr/latex",
+                    headers=HEADERS,
+                    files={"file": ("test.png", image_bytes, "image/png")}
+                )
+                for _ in range(settings.RATE_LIMIT_PER_MINUTE + 5)
+            ])
+        
+        status_codes = [response.status_code for response in responses]
         
         # Pelo menos uma deve retornar 429 (Too Many Requests)
-        assert 429 in responses
+        assert 429 in status_codes
+    
+    @pytest.mark.asyncio
+    async def test_require_rate_limit_per_api_key(self, monkeypatch):
+        """Testa o limite por API key com um pipeline Redis simulado"""
+        counters = {}
+        
+        class FakePipeline:
+            def __init__(self):
+                self.key = None
+            
+            def incr(self, key):
+                self.key = key
+            
+            def expire(self, key, seconds):
+                pass
+            
+            async def execute(self):
+                counters[self.key] = counters.get(self.key, 0) + 1
+                return [counters[self.key], True]
+        
+        class FakeRedis:
+            def pipeline(self):
+                return FakePipeline()
+        
+        monkeypatch.setattr(security.settings, "REDIS_ENABLED", True)
+        monkeypatch.setattr(security, "get_redis_client", lambda: FakeRedis())
+        
+        user = {"api_key": "premium-key", "rate_limit": 3}
+        
+        for _ in range(3):
+            assert await security.require_rate_limit(user) is user
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await security.require_rate_limit(user)
+        
+        assert exc_info.value.status_code == 429
+        assert "Retry-After" in exc_info.value.headers
+    
+    @pytest.mark.asyncio
+    async def test_require_rate_limit_fails_closed(self, monkeypatch):
+        """Testa que uma falha do Redis bloqueia a requisição (503)"""
+        class BrokenPipeline:
+            def incr(self, key):
+                pass
+            
+            def expire(self, key, seconds):
+                pass
+            
+            async def execute(self):
+                raise ConnectionError("Redis down")
+        
+        class BrokenRedis:
+            def pipeline(self):
+                return BrokenPipeline()
+        
+        monkeypatch.setattr(security.settings, "REDIS_ENABLED", True)
+        monkeypatch.setattr(security, "get_redis_client", lambda: BrokenRedis())
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await security.require_rate_limit({"api_key": "k", "rate_limit": 3})
+        
+        assert exc_info.value.status_code == 503
 
 
 # Executar testes
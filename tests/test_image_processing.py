@@ -0,0 +1,85 @@
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+import io
+
+from app.utils.image_processing import validate_and_process_image
+
+
+def create_upload(width, height, image_format="PNG", filename="test.png"):
+    """
+    Cria um upload com uma imagem de teste no formato indicado
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (255, 255, 255)).save(buffer, format=image_format)
+    contents = buffer.getvalue()
+    return UploadFile(file=io.BytesIO(contents), size=len(contents), filename=filename)
+
+
+class TestResize:
+    """Testes do redimensionamento antes do envio ao Ollama"""
+    
+    @pytest.mark.asyncio
+    async def test_large_png_is_resized(self):
+        """Testa que os bytes enviados descrevem a imagem reduzida"""
+        upload = create_upload(2000, 1000)
+        
+        image, image_bytes, image_info = await validate_and_process_image(
+            upload, max_dimension=1024
+        )
+        
+        assert image.size == (1024, 512)
+        with Image.open(io.BytesIO(image_bytes)) as sent:
+            assert sent.size == image.size
+            assert sent.format == "PNG"
+        
+        # Metadata descreve o upload original
+        assert (image_info["width"], image_info["height"]) == (2000, 1000)
+    
+    @pytest.mark.asyncio
+    async def test_square_jpeg_drafted_to_final_size_is_reencoded(self):
+        """Testa JPEG que o draft já decodifica no tamanho final (sem resize)"""
+        upload = create_upload(2048, 2048, "JPEG", "photo.jpg")
+        
+        image, image_bytes, _ = await validate_and_process_image(
+            upload, max_dimension=1024
+        )
+        
+        assert image.size == (1024, 1024)
+        with Image.open(io.BytesIO(image_bytes)) as sent:
+            assert sent.size == (1024, 1024)
+            assert sent.format == "JPEG"
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("width,height", [(2048, 1536), (4096, 3072), (4096, 1024)])
+    async def test_jpeg_bytes_sent_are_within_max_dimension(self, width, height):
+        """Testa que os bytes enviados ao predict descrevem uma imagem <= 1024px"""
+        upload = create_upload(width, height, "JPEG", "photo.jpg")
+        
+        image, image_bytes, image_info = await validate_and_process_image(
+            upload, max_dimension=1024
+        )
+        
+        with Image.open(io.BytesIO(image_bytes)) as sent:
+            assert max(sent.size) <= 1024
+            assert sent.size == image.size
+        
+        assert (image_info["width"], image_info["height"]) == (width, height)
+    
+    @pytest.mark.asyncio
+    async def test_small_image_is_sent_unchanged(self):
+        """Testa que imagens dentro do limite seguem com os bytes originais"""
+        upload = create_upload(200, 100)
+        original = upload.file.getvalue()
+        
+        image, image_bytes, _ = await validate_and_process_image(
+            upload, max_dimension=1024
+        )
+        
+        assert image.size == (200, 100)
+        assert image_bytes == original
+
+
+# Executar testes
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
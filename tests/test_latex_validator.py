@@ -0,0 +1,63 @@
+import pytest
+
+from app.utils.latex_validator import (
+    clean_latex,
+    validate_brackets,
+    validate_latex,
+    fix_common_issues
+)
+
+
+class TestCleanLatex:
+    """Testes da limpeza do LaTeX retornado pelo modelo"""
+    
+    def test_fenced_latex(self):
+        """Testa remoção das cercas markdown"""
+        assert clean_latex("```latex\nx^2 + y^2\n```") == "x^2 + y^2"
+        assert clean_latex("```\nx^2\n```") == "x^2"
+    
+    def test_empty_fenced_latex(self):
+        """Testa resposta com cercas vazias (deve resultar em LaTeX vazio)"""
+        assert clean_latex("```latex```") == ""
+        assert clean_latex("```latex\n```") == ""
+        assert validate_latex(clean_latex("```latex```")) == (False, "Empty LaTeX code")
+
+
+class TestValidateBrackets:
+    """Testes da validação de brackets"""
+    
+    def test_balanced_brackets(self):
+        """Testa brackets balanceados"""
+        assert validate_brackets(r"\frac{a}{(b+c)}") == (True, "")
+    
+    def test_unclosed_brackets_message(self):
+        """Testa mensagem de brackets não fechados (lista todas as posições)"""
+        assert validate_brackets("{a(b") == (
+            False,
+            "Unclosed brackets: '{' at position 0, '(' at position 2"
+        )
+    
+    def test_mismatched_brackets(self):
+        """Testa brackets trocados"""
+        assert validate_brackets("{a)") == (
+            False,
+            "Mismatched brackets: '{' at 0 and ')' at 2"
+        )
+
+
+class TestFixCommonIssues:
+    """Testes das correções automáticas"""
+    
+    def test_unpaired_left(self):
+        """Testa \\left sem \\right correspondente"""
+        assert fix_common_issues(r"\left( x") == r"\left( x\right."
+    
+    def test_arrow_commands_are_not_delimiters(self):
+        """Testa que \\leftarrow e \\rightarrow não contam como \\left/\\right"""
+        assert fix_common_issues(r"\leftarrow x") == r"\leftarrow x"
+        assert fix_common_issues(r"x \rightarrow y") == r"x \rightarrow y"
+
+
+# Executar testes
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])